@@ -9,109 +9,194 @@ Now with persistent database storage!
 
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response
+import asyncio
+from collections import defaultdict
 import os
+import orjson
 from pathlib import Path
-from sqlalchemy.orm import Session
-from .database import get_db, init_db, seed_initial_data, Activity, Participant
+from uuid import uuid4
+from sqlalchemy import bindparam, delete, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import (DBSessionMiddleware, get_db, init_db, load_activity_index, seed_initial_data,
+                       Activity, Meta, Participant, ACTIVITIES_VERSION_KEY)
 
 app = FastAPI(title="Mergington High School API",
               description="API for viewing and signing up for extracurricular activities")
+app.add_middleware(DBSessionMiddleware)
+
+# Serialized /activities body and the activities_version it was built at. Every
+# worker compares that version with the shared meta row, so a signup handled
+# by one worker is visible to the others on their next request.
+_activities_cache = {"body": None, "version": None}
+_activities_cache_lock = asyncio.Lock()
+
+
+# Activity name -> (id, max_participants); activities only change when seeded
+ACTIVITY_INDEX: dict[str, tuple[int, int]] = {}
+
+
+async def refresh_activity_index():
+    """Reload the activity index; call again if activities are ever edited"""
+    ACTIVITY_INDEX.clear()
+    ACTIVITY_INDEX.update(await load_activity_index())
+
+
+# Set SEED_ON_STARTUP=0 where the database is provisioned separately
+SEED_ON_STARTUP = os.getenv("SEED_ON_STARTUP", "1") == "1"
+
 
 # Initialize database on startup
 @app.on_event("startup")
-def startup_event():
-    init_db()
-    seed_initial_data()
+async def startup_event():
+    await init_db()
+    if SEED_ON_STARTUP:
+        await seed_initial_data()
+    await refresh_activity_index()
 
-# Mount the static files directory
-current_dir = Path(__file__).parent
-app.mount("/static", StaticFiles(directory=os.path.join(Path(__file__).parent,
-          "static")), name="static")
+# Mount the static files directory; set SERVE_STATIC=0 when a reverse proxy serves /static
+STATIC_DIR = (Path(__file__).parent / "static").resolve()
+SERVE_STATIC = os.getenv("SERVE_STATIC", "1") == "1"
+if SERVE_STATIC:
+    app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 
 @app.get("/")
 def root():
-    return RedirectResponse(url="/static/index.html")
+    # Let browsers reuse the redirect instead of asking for it on every visit
+    return RedirectResponse(url="/static/index.html", status_code=307,
+                            headers={"Cache-Control": "public, max-age=3600"})
+
+
+# Hot statements are built once at import; handlers only bind parameters
+_select_activity_rows = select(
+    Activity.id, Activity.name, Activity.description,
+    Activity.schedule, Activity.max_participants
+)
+_select_participant_rows = select(Participant.activity_id, Participant.email).order_by(Participant.id)
+# Add student only while there is still room; the UNIQUE constraint on
+# (activity_id, email) rejects duplicate signups in the same statement
+_insert_participant_if_room = text(
+    "INSERT INTO participants (activity_id, email) "
+    "SELECT :aid, :email "
+    "WHERE (SELECT COUNT(*) FROM participants WHERE activity_id = :aid) < :maxp"
+)
+_select_participant_exists = select(Participant.id).where(
+    Participant.activity_id == bindparam("aid"),
+    Participant.email == bindparam("email")
+).limit(1)
+_select_activities_version = select(Meta.value).where(Meta.key == ACTIVITIES_VERSION_KEY)
+_bump_activities_version = update(Meta).where(
+    Meta.key == ACTIVITIES_VERSION_KEY
+).values(value=bindparam("version")).execution_options(synchronize_session=False)
+_delete_participant = delete(Participant).where(
+    Participant.activity_id == bindparam("aid"),
+    Participant.email == bindparam("email")
+).execution_options(synchronize_session=False)
+
+
+async def build_activities_body(db: AsyncSession):
+    """Query all activities with their participants and serialize them to JSON"""
+    # Fetch plain column rows instead of ORM entities: one query per table
+    activity_rows = (await db.execute(_select_activity_rows)).all()
+    participant_rows = await db.execute(_select_participant_rows)
+
+    participants_by_activity = defaultdict(list)
+    for activity_id, email in participant_rows:
+        participants_by_activity[activity_id].append(email)
+
+    # Build response in the same format as before
+    result = {
+        name: {
+            "description": description,
+            "schedule": schedule,
+            "max_participants": max_participants,
+            "participants": participants_by_activity[activity_id]
+        }
+        for activity_id, name, description, schedule, max_participants in activity_rows
+    }
+
+    return orjson.dumps(result)
 
 
 @app.get("/activities")
-def get_activities(db: Session = Depends(get_db)):
+async def get_activities(db: AsyncSession = Depends(get_db)):
     """Get all activities with their participants"""
-    activities = db.query(Activity).all()
-    
-    # Build response in the same format as before
-    result = {}
-    for activity in activities:
-        participants = db.query(Participant.email).filter(
-            Participant.activity_id == activity.id
-        ).all()
-        participant_emails = [p.email for p in participants]
-        result[activity.name] = activity.to_dict(participant_emails)
-    
-    return result
+    version = await db.scalar(_select_activities_version)
+    body = _activities_cache["body"]
+    if body is None or _activities_cache["version"] != version:
+        # Only one request rebuilds the body; the rest wait and reuse it
+        async with _activities_cache_lock:
+            body = _activities_cache["body"]
+            if body is None or _activities_cache["version"] != version:
+                body = await build_activities_body(db)
+                _activities_cache["body"] = body
+                _activities_cache["version"] = version
+
+    return Response(content=body, media_type="application/json")
 
 
 @app.post("/activities/{activity_name}/signup")
-def signup_for_activity(activity_name: str, email: str, db: Session = Depends(get_db)):
+async def signup_for_activity(activity_name: str, email: str, db: AsyncSession = Depends(get_db)):
     """Sign up a student for an activity"""
     # Validate activity exists
-    activity = db.query(Activity).filter(Activity.name == activity_name).first()
-    if not activity:
+    activity = ACTIVITY_INDEX.get(activity_name)
+    if activity is None:
         raise HTTPException(status_code=404, detail="Activity not found")
+    activity_id, max_participants = activity
 
-    # Check if student is already signed up
-    existing_participant = db.query(Participant).filter(
-        Participant.activity_id == activity.id,
-        Participant.email == email
-    ).first()
-    
-    if existing_participant:
+    # Insert only while there is room and the student isn't already signed up
+    try:
+        result = await db.execute(
+            _insert_participant_if_room,
+            {"aid": activity_id, "email": email, "maxp": max_participants}
+        )
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(
             status_code=400,
             detail="Student is already signed up"
         )
 
-    # Check if activity is full
-    current_count = db.query(Participant).filter(
-        Participant.activity_id == activity.id
-    ).count()
-    
-    if current_count >= activity.max_participants:
+    if result.rowcount == 0:
+        # The capacity guard filters the row out before the UNIQUE index can fire,
+        # so only the failure path checks whether the student was already there
+        already_signed_up = await db.scalar(
+            _select_participant_exists, {"aid": activity_id, "email": email}
+        ) is not None
+        await db.rollback()
         raise HTTPException(
             status_code=400,
-            detail="Activity is full"
+            detail="Student is already signed up" if already_signed_up else "Activity is full"
         )
 
-    # Add student
-    new_participant = Participant(activity_id=activity.id, email=email)
-    db.add(new_participant)
-    db.commit()
+    await db.execute(_bump_activities_version, {"version": uuid4().hex})
+    await db.commit()
     
     return {"message": f"Signed up {email} for {activity_name}"}
 
 
 @app.delete("/activities/{activity_name}/unregister")
-def unregister_from_activity(activity_name: str, email: str, db: Session = Depends(get_db)):
+async def unregister_from_activity(activity_name: str, email: str, db: AsyncSession = Depends(get_db)):
     """Unregister a student from an activity"""
     # Validate activity exists
-    activity = db.query(Activity).filter(Activity.name == activity_name).first()
-    if not activity:
+    activity = ACTIVITY_INDEX.get(activity_name)
+    if activity is None:
         raise HTTPException(status_code=404, detail="Activity not found")
+    activity_id, _ = activity
 
-    # Find and remove the participant
-    participant = db.query(Participant).filter(
-        Participant.activity_id == activity.id,
-        Participant.email == email
-    ).first()
-    
-    if not participant:
+    # Remove the participant in a single statement
+    result = await db.execute(_delete_participant, {"aid": activity_id, "email": email})
+
+    if result.rowcount == 0:
+        await db.rollback()
         raise HTTPException(
             status_code=400,
             detail="Student is not signed up for this activity"
         )
 
-    db.delete(participant)
-    db.commit()
+    await db.execute(_bump_activities_version, {"version": uuid4().hex})
+    await db.commit()
     
     return {"message": f"Unregistered {email} from {activity_name}"}
@@ -2,15 +2,53 @@
 Database models and session management for the High School Management System
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Table
+from sqlalchemy import event, inspect, func, Column, Integer, String, ForeignKey, Index, Table, delete, insert, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
+from starlette.requests import Request
+from datetime import datetime, timezone
 import os
+from uuid import uuid4
+
+# Database setup (async drivers, e.g. sqlite+aiosqlite or postgresql+asyncpg)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url):
+    """Swap a sync driver for its async counterpart so older DATABASE_URLs keep working"""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+DATABASE_URL = to_async_url(os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./school_activities.db"))
+# In-memory SQLite gets a single shared connection (StaticPool), which takes no sizing
+IN_MEMORY_SQLITE = (DATABASE_URL.get_backend_name() == "sqlite"
+                    and DATABASE_URL.database in (None, "", ":memory:"))
+pool_sizing = {} if IN_MEMORY_SQLITE else {"pool_size": 20, "max_overflow": 40}
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    **pool_sizing,
+)
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+if DATABASE_URL.get_backend_name() == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, connection_record):
+        """Use WAL so reads can proceed while a write is in flight"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 
-# Database setup
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./school_activities.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
@@ -33,21 +71,15 @@ class Activity(Base):
     schedule = Column(String, nullable=False)
     max_participants = Column(Integer, nullable=False)
 
-    def to_dict(self, participants=None):
-        """Convert activity to dictionary format matching API response"""
-        if participants is None:
-            participants = []
-        return {
-            "description": self.description,
-            "schedule": self.schedule,
-            "max_participants": self.max_participants,
-            "participants": participants
-        }
-
 
 class Participant(Base):
     """Participant model representing a student participant"""
     __tablename__ = "participants"
+    __table_args__ = (
+        # A student can only sign up once per activity; the index also serves
+        # (activity_id, email) lookups and lookups by activity_id alone
+        Index('ix_part_act_email', 'activity_id', 'email', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     activity_id = Column(Integer, ForeignKey('activities.id'), nullable=False)
@@ -56,27 +88,99 @@ class Participant(Base):
     activity = relationship("Activity", backref="participant_records")
 
 
-def get_db():
-    """Get database session"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+class Meta(Base):
+    """Key/value metadata about the database itself, e.g. whether it was seeded"""
+    __tablename__ = "meta"
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+
+SEEDED_KEY = "seeded"
+# Changed with every signup/unregister so each worker can tell its cached list is stale
+ACTIVITIES_VERSION_KEY = "activities_version"
+
+
+class DBSessionMiddleware:
+    """ASGI middleware that opens one session per HTTP request and closes it afterwards"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # Sessions connect lazily, so requests that never query cost no connection
+        async with SessionLocal() as db:
+            scope.setdefault("state", {})["db"] = db
+            await self.app(scope, receive, send)
+
+
+async def get_db(request: Request):
+    """Get the request's database session opened by DBSessionMiddleware"""
+    return request.state.db
 
 
-def init_db():
+async def init_db():
     """Initialize database with schema"""
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # create_all skips existing tables, so add indexes missing from older databases
+        existing = {ix["name"] for ix in await conn.run_sync(
+            lambda sync_conn: inspect(sync_conn).get_indexes(Participant.__tablename__)
+        )}
+        for index in Participant.__table__.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                # Older signups weren't atomic; keep the earliest row of any duplicate
+                # so the unique index can be built
+                keep = select(func.min(Participant.id)).group_by(*index.columns)
+                result = await conn.execute(delete(Participant).where(Participant.id.not_in(keep)))
+                if result.rowcount:
+                    print(f"Removed {result.rowcount} duplicate participant rows before creating {index.name}.")
+            await conn.run_sync(index.create)
+
+    try:
+        async with engine.begin() as conn:
+            if await conn.scalar(select(Meta.key).where(Meta.key == ACTIVITIES_VERSION_KEY)) is None:
+                await conn.execute(insert(Meta).values(key=ACTIVITIES_VERSION_KEY, value=uuid4().hex))
+    except IntegrityError:
+        # Another worker created the row first
+        pass
+
+
+async def load_activity_index():
+    """Map each activity name to its (id, max_participants)"""
+    async with SessionLocal() as db:
+        rows = await db.execute(select(Activity.name, Activity.id, Activity.max_participants))
+        return {name: (activity_id, max_participants) for name, activity_id, max_participants in rows}
+
+
+async def is_seeded():
+    """Check the seed marker with one primary-key lookup, without opening a Session"""
+    async with engine.connect() as conn:
+        return await conn.scalar(select(Meta.value).where(Meta.key == SEEDED_KEY)) is not None
 
 
-def seed_initial_data():
+def seeded_marker():
+    """Meta row recording when the database was seeded"""
+    return Meta(key=SEEDED_KEY, value=datetime.now(timezone.utc).isoformat())
+
+
+async def seed_initial_data():
     """Seed the database with initial activity data"""
+    if await is_seeded():
+        print("Database already seeded. Skipping seed.")
+        return
+
     db = SessionLocal()
     try:
-        # Check if data already exists
-        existing_activities = db.query(Activity).count()
-        if existing_activities > 0:
+        # Databases seeded before the marker existed: record it and skip
+        if await db.scalar(select(Activity.id).limit(1)) is not None:
+            db.add(seeded_marker())
+            await db.commit()
             print("Database already contains data. Skipping seed.")
             return
 
@@ -147,27 +251,36 @@ def seed_initial_data():
             }
         ]
 
-        # Create activities and participants
-        for activity_data in activities_data:
-            activity = Activity(
-                name=activity_data["name"],
-                description=activity_data["description"],
-                schedule=activity_data["schedule"],
-                max_participants=activity_data["max_participants"]
-            )
-            db.add(activity)
-            db.flush()  # Flush to get the activity ID
-
-            # Add participants
-            for email in activity_data["participants"]:
-                participant = Participant(activity_id=activity.id, email=email)
-                db.add(participant)
-
-        db.commit()
+        # Bulk insert activities, then all participants, in two executemany round-trips
+        activities_rows = [
+            {
+                "name": activity_data["name"],
+                "description": activity_data["description"],
+                "schedule": activity_data["schedule"],
+                "max_participants": activity_data["max_participants"]
+            }
+            for activity_data in activities_data
+        ]
+        await db.execute(insert(Activity), activities_rows)
+
+        id_map = dict((await db.execute(select(Activity.name, Activity.id))).all())
+        participants_rows = [
+            {"activity_id": id_map[activity_data["name"]], "email": email}
+            for activity_data in activities_data
+            for email in activity_data["participants"]
+        ]
+        await db.execute(insert(Participant), participants_rows)
+
+        db.add(seeded_marker())
+        await db.commit()
         print("Database seeded successfully!")
+    except IntegrityError:
+        # Another worker seeded (or marked) the database first
+        await db.rollback()
+        print("Database was seeded by another worker. Skipping seed.")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error seeding database: {e}")
         raise
     finally:
-        db.close()
+        await db.close()